@@ -3,25 +3,64 @@
 import logging
 from datetime import timedelta
 
-from homeassistant.core import HomeAssistant
+import voluptuous as vol
+
+from homeassistant.core import HomeAssistant, ServiceCall, SupportsResponse
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.exceptions import ConfigEntryAuthFailed, ConfigEntryNotReady
+from homeassistant.exceptions import ConfigEntryAuthFailed, ConfigEntryNotReady, ServiceValidationError
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
 from homeassistant.helpers.issue_registry import async_delete_issue
+from homeassistant.helpers.storage import Store
+import homeassistant.helpers.config_validation as cv
 
-from .switch import TadoGeoreferencingSwitch, TadoWindowControlSwitch, TadoAwaySwitch
-from .const import DOMAIN, DEFAULT_SCAN_INTERVAL
-from .tado_api import TadoAPI, TadoAuthError, TadoApiError
+from .const import (
+    DOMAIN,
+    DEFAULT_SCAN_INTERVAL,
+    PLATFORMS,
+    SNAPSHOT_STORAGE_VERSION,
+    SNAPSHOT_SAVE_DELAY,
+    SERVICE_CAPTURE_PROFILE,
+    ATTR_POLLS,
+    DEFAULT_PROFILE_POLLS,
+    ATTR_CONFIG_ENTRY_ID,
+    ATTR_TIMEOUT,
+    DEFAULT_PROFILE_TIMEOUT,
+    SERVICE_DUMP_HISTORY,
+    ATTR_EXPAND,
+    FLEET_MAX_CONCURRENCY,
+)
+from .fleet import TadoFleetScheduler
+from .window_episodes import WindowEpisodeTracker
+from .tado_api import TadoAPI, TadoAuthError, TadoApiError, TadoQuotaError
 
 _LOGGER = logging.getLogger(__name__)
 
+CAPTURE_PROFILE_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_CONFIG_ENTRY_ID): cv.string,
+    vol.Optional(ATTR_POLLS, default=DEFAULT_PROFILE_POLLS): vol.All(cv.positive_int, vol.Range(min=1, max=100)),
+    vol.Optional(ATTR_TIMEOUT, default=DEFAULT_PROFILE_TIMEOUT): vol.All(cv.positive_int, vol.Range(min=10, max=86400)),
+})
+
+DUMP_HISTORY_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_EXPAND, default=False): cv.boolean,
+})
+
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up Tado Assist from a config entry."""
 
     hass.data.setdefault(DOMAIN, {})
-    hass.data[DOMAIN].setdefault("tado_assist_status", True)
-    hass.data[DOMAIN].setdefault("tado_georeferencing_status", False)
-    hass.data[DOMAIN].setdefault("tado_window_control_status", False)
+    if "fleet" not in hass.data[DOMAIN]:
+        hass.data[DOMAIN]["fleet"] = TadoFleetScheduler(hass, FLEET_MAX_CONCURRENCY)
+
+    # Stato separato per ogni account: più config entry possono convivere nella stessa istanza
+    entry_data = {
+        "tado_assist_status": True,
+        "tado_georeferencing_status": False,
+        "tado_window_control_status": False,
+        "window_episodes": WindowEpisodeTracker(),
+        # Diventa True al primo poll riuscito: prima i dati vengono dallo snapshot su disco
+        "live_data": False,
+    }
 
     scan_interval = timedelta(seconds=entry.data.get("scan_interval", DEFAULT_SCAN_INTERVAL))
     refresh_token = entry.data.get("refresh_token")
@@ -30,112 +69,216 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
 
     tado = TadoAPI(hass, entry, refresh_token=refresh_token)
 
-    try:
-        status_result = await tado.async_initialize()
-    except (TadoAuthError, ConfigEntryAuthFailed) as err:
-        _LOGGER.warning("TadoAPI: authentication failed, triggering reauth.")
-        raise ConfigEntryAuthFailed("Autenticazione non riuscita, reauth necessaria.") from err
-    except TadoApiError as err:
-        # QUESTO È IL FIX: Se all'avvio Tado ci blocca per il Rate Limit o non c'è internet,
-        # diciamo ad HA di riprovare più tardi in background.
-        _LOGGER.warning("Server Tado non pronto o Rate Limit raggiunto all'avvio. Riprovo più tardi...")
-        raise ConfigEntryNotReady(f"Impossibile comunicare con Tado all'avvio: {err}") from err
-    except Exception as err:
-        # Cattura qualsiasi altro errore imprevisto
-        _LOGGER.error("Errore generico durante l'inizializzazione: %s", err)
-        raise ConfigEntryNotReady(f"Errore generico: {err}") from err
+    # Snapshot dell'ultimo poll salvato su disco: permette di creare le entità
+    # senza attendere la rete e di saltare /me se l'home_id è già noto.
+    store = Store(hass, SNAPSHOT_STORAGE_VERSION, _snapshot_key(entry))
+    snapshot = await store.async_load() or {}
+    cached_data = snapshot.get("data") or {}
 
-    status = status_result.get("status")
-    
-    if status in ["NOT_STARTED", "PENDING"]:
-        _LOGGER.error("Il flusso Tado non è completato. Riconfigurare l'integrazione.")
-        raise ConfigEntryAuthFailed("Authentication non completata.")
-
-    elif status != "COMPLETED":
-        _LOGGER.error(f"Tado ha restituito uno stato inatteso: {status}")
+    if snapshot.get("home_id"):
+        tado.home_id = snapshot["home_id"]
+        _LOGGER.debug("Home ID %s caricato dallo snapshot, login rimandato al primo aggiornamento.", tado.home_id)
+    elif not await _async_initialize_tado(tado):
         return False
 
-    hass.data[DOMAIN]["tado"] = tado
+    entry_data["tado"] = tado
+    entry_data["store"] = store
+    tracer = tado.tracer
+    if cached_data:
+        entry_data["last_data"] = cached_data
 
     async def async_update_data():
         """Fetch the latest data from Tado servers."""
 
-        if not hass.data[DOMAIN]["tado_assist_status"]:
-            return hass.data[DOMAIN].get("last_data", {})
+        if not entry_data["tado_assist_status"]:
+            return entry_data.get("last_data", {})
 
+        tracer.poll_started()
+        with tracer.span("poll"):
+            return await _async_poll()
+
+    async def _async_poll():
+        """Esegue un ciclo di polling completo, tracciando ogni fase."""
         try:
-            home_state = await tado.get_home_state() or {}
-            mobile_devices = await tado.get_mobile_devices() or 0
-            open_window_zones = await tado.get_open_window_detected() or []
+            with tracer.span("get_home_state"):
+                home_state = await tado.get_home_state() or {}
+            with tracer.span("get_mobile_devices"):
+                mobile_devices = await tado.get_mobile_devices() or 0
+            with tracer.span("get_open_window_detected"):
+                open_window_zones = await tado.get_open_window_detected() or []
 
             open_window_zone_ids = [zone["id"] for zone in open_window_zones]
             open_window_zone_names = [zone["name"] for zone in open_window_zones]
+            entry_data["window_episodes"].update(open_window_zones)
             
         except (TadoAuthError, ConfigEntryAuthFailed) as e:
             # QUESTO SALVA DAL CRASH: se il token muore definitivamente (revocato/scaduto per sempre)
             _LOGGER.warning("Token scaduto in modo permanente, avvio Repair flow.")
+            tado.history.record_failure("auth", e)
             raise ConfigEntryAuthFailed("Token non più valido, richiesta riconfigurazione.") from e
-            
+
+        except TadoQuotaError as e:
+            # Poll rinunciato per preservare la riserva di quota: restano validi i dati dell'ultimo poll
+            tado.history.record_failure("quota", e)
+            if entry_data.get("last_data") is None:
+                raise UpdateFailed(f"Errore di comunicazione: {e}") from e
+            _LOGGER.info("Poll rimandato: %s", e)
+            return entry_data["last_data"]
+
         except Exception as e:
             # Se siamo in Rate Limit (429) o manca internet, diciamo ad HA che l'aggiornamento è fallito!
             # HA metterà le entità in "Non disponibile" e rallenterà automaticamente le chiamate per non farsi bannare.
             _LOGGER.error("Errore di comunicazione con Tado: %s", e)
+            tado.history.record_failure("error", e)
             raise UpdateFailed(f"Errore di comunicazione: {e}") from e
 
-        tado_georeferencing_status = any(
-            isinstance(entity, TadoGeoreferencingSwitch) and entity.is_on
-            for entity in hass.data[DOMAIN].get("switch_entities", [])
-        )
+        georeferencing_switch = entry_data.get("georeferencing_switch")
+        window_control_switch = entry_data.get("window_control_switch")
 
-        tado_window_control_status = any(
-            isinstance(entity, TadoWindowControlSwitch) and entity.is_on
-            for entity in hass.data[DOMAIN].get("switch_entities", [])
-        )
+        tado_georeferencing_status = bool(georeferencing_switch and georeferencing_switch.is_on)
+        tado_window_control_status = bool(window_control_switch and window_control_switch.is_on)
 
         new_data = {
             "home_state": home_state,
             "mobile_devices": mobile_devices,
+            "mobile_device_states": {device_id: dict(device) for device_id, device in tado.mobile_devices.devices.items()},
             "open_window_zone_ids": open_window_zone_ids,
             "open_window_zone_names": open_window_zone_names,
+            "window_episodes": entry_data["window_episodes"].as_dict(),
             "tado_georeferencing_status": tado_georeferencing_status,
             "tado_window_control_status": tado_window_control_status,
         }
 
-        hass.data[DOMAIN]["last_data"] = new_data
+        entry_data["last_data"] = new_data
+        entry_data["live_data"] = True
+        store.async_delay_save(lambda: {"home_id": tado.home_id, "data": new_data}, SNAPSHOT_SAVE_DELAY)
 
-        if new_data["tado_georeferencing_status"]:
-            for entity in hass.data[DOMAIN].get("switch_entities", []):
-                if isinstance(entity, TadoGeoreferencingSwitch):
-                    await entity.async_check_and_set_home_or_away()
+        try:
+            if new_data["tado_georeferencing_status"]:
+                await georeferencing_switch.async_check_and_set_home_or_away(new_data)
 
-        if new_data["tado_window_control_status"]:
-            for entity in hass.data[DOMAIN].get("switch_entities", []):
-                if isinstance(entity, TadoWindowControlSwitch):
-                    await entity.async_check_and_pause_thermostat()
+            if new_data["tado_window_control_status"]:
+                await window_control_switch.async_check_and_pause_thermostat()
+        except TadoQuotaError as err:
+            # I dati del poll restano validi: le scritture automatiche verranno ritentate al prossimo poll
+            _LOGGER.warning("Azioni automatiche rimandate: %s", err)
+
+        # Registrato dopo le azioni: la voce dello storico include ciò che questo poll ha fatto
+        tado.history.record_poll(new_data)
 
         return new_data
 
     coordinator = DataUpdateCoordinator(
         hass,
         _LOGGER,
+        config_entry=entry,
         name="Tado Assist",
         update_method=async_update_data,
-        update_interval=scan_interval,
+        # Nessun timer per entry: i poll periodici sono gestiti dallo scheduler condiviso
+        update_interval=None,
     )
+    # Le entità partono dallo snapshot (o da un dizionario vuoto) invece che da None
+    coordinator.data = cached_data
+
+    entry_data["coordinator"] = coordinator
+    hass.data[DOMAIN][entry.entry_id] = entry_data
 
-    hass.data[DOMAIN][entry.entry_id] = coordinator
+    await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
 
-    await coordinator.async_config_entry_first_refresh()
-    await hass.config_entries.async_forward_entry_setups(entry, ["binary_sensor", "switch"])
+    # Registrato dopo le entità: chiude il record del poll quando anche le scritture di stato sono terminate
+    entry.async_on_unload(coordinator.async_add_listener(tracer.poll_finished))
+    entry.async_on_unload(tracer.async_cancel_capture)
+
+    async def async_capture_profile(call: ServiceCall):
+        """Cattura il profilo dei prossimi N poll (di un account o di tutti) e lo salva in un report JSON."""
+        accounts = {
+            entry_id: data for entry_id, data in hass.data[DOMAIN].items() if isinstance(data, dict) and "tado" in data
+        }
+        if ATTR_CONFIG_ENTRY_ID in call.data:
+            entry_id = call.data[ATTR_CONFIG_ENTRY_ID]
+            if entry_id not in accounts:
+                raise ServiceValidationError(f"Nessun account Tado Assist caricato con entry id {entry_id}.")
+            accounts = {entry_id: accounts[entry_id]}
+        for data in accounts.values():
+            data["tado"].tracer.async_start_capture(call.data[ATTR_POLLS], call.data[ATTR_TIMEOUT])
+
+    async def async_dump_history(call: ServiceCall):
+        """Restituisce lo storico degli ultimi poll di ogni account."""
+        return {
+            entry_id: data["tado"].history.as_dict(expand=call.data[ATTR_EXPAND])
+            for entry_id, data in hass.data[DOMAIN].items()
+            if isinstance(data, dict) and "tado" in data
+        }
+
+    if not hass.services.has_service(DOMAIN, SERVICE_CAPTURE_PROFILE):
+        hass.services.async_register(
+            DOMAIN, SERVICE_CAPTURE_PROFILE, async_capture_profile, schema=CAPTURE_PROFILE_SCHEMA
+        )
+        hass.services.async_register(
+            DOMAIN,
+            SERVICE_DUMP_HISTORY,
+            async_dump_history,
+            schema=DUMP_HISTORY_SCHEMA,
+            supports_response=SupportsResponse.ONLY,
+        )
+
+    # Il primo aggiornamento dalla rete non blocca l'avvio di HA: lo esegue lo scheduler condiviso,
+    # distribuendo gli account nel tempo. Gli errori di autenticazione avviano comunque il reauth.
+    entry.async_on_unload(
+        hass.data[DOMAIN]["fleet"].async_register(entry.entry_id, coordinator, tado, scan_interval.total_seconds())
+    )
 
     async_delete_issue(hass, DOMAIN, issue_id="auth_not_started")
     async_delete_issue(hass, DOMAIN, issue_id="auth_pending")
 
     return True
 
+def _snapshot_key(entry: ConfigEntry) -> str:
+    return f"{DOMAIN}.{entry.entry_id}.snapshot"
+
+async def _async_initialize_tado(tado: TadoAPI) -> bool:
+    """Esegue il login completo (refresh token + /me) quando non c'è uno snapshot utilizzabile."""
+    try:
+        status_result = await tado.async_initialize()
+    except (TadoAuthError, ConfigEntryAuthFailed) as err:
+        _LOGGER.warning("TadoAPI: authentication failed, triggering reauth.")
+        raise ConfigEntryAuthFailed("Autenticazione non riuscita, reauth necessaria.") from err
+    except TadoApiError as err:
+        # QUESTO È IL FIX: Se all'avvio Tado ci blocca per il Rate Limit o non c'è internet,
+        # diciamo ad HA di riprovare più tardi in background.
+        _LOGGER.warning("Server Tado non pronto o Rate Limit raggiunto all'avvio. Riprovo più tardi...")
+        raise ConfigEntryNotReady(f"Impossibile comunicare con Tado all'avvio: {err}") from err
+    except Exception as err:
+        # Cattura qualsiasi altro errore imprevisto
+        _LOGGER.error("Errore generico durante l'inizializzazione: %s", err)
+        raise ConfigEntryNotReady(f"Errore generico: {err}") from err
+
+    status = status_result.get("status")
+    
+    if status in ["NOT_STARTED", "PENDING"]:
+        _LOGGER.error("Il flusso Tado non è completato. Riconfigurare l'integrazione.")
+        raise ConfigEntryAuthFailed("Authentication non completata.")
+
+    elif status != "COMPLETED":
+        _LOGGER.error(f"Tado ha restituito uno stato inatteso: {status}")
+        return False
+
+    return True
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a Tado Assist config entry."""
-    unload_ok = await hass.config_entries.async_unload_platforms(entry, ["binary_sensor", "switch"])
+    unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     if unload_ok:
-        hass.data[DOMAIN].pop(entry.entry_id, None)
-    return unload_ok
\ No newline at end of file
+        entry_data = hass.data[DOMAIN].pop(entry.entry_id, None)
+        if entry_data and entry_data.get("live_data"):
+            # Scrive subito lo snapshot in sospeso: un salvataggio ritardato dopo la rimozione ricreerebbe il file
+            await entry_data["store"].async_save({"home_id": entry_data["tado"].home_id, "data": entry_data["last_data"]})
+        if not any(isinstance(data, dict) and "tado" in data for data in hass.data[DOMAIN].values()):
+            hass.services.async_remove(DOMAIN, SERVICE_CAPTURE_PROFILE)
+            hass.services.async_remove(DOMAIN, SERVICE_DUMP_HISTORY)
+    return unload_ok
+
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Remove the shared auth broker and the on-disk snapshot of a deleted Tado Assist entry."""
+    hass.data.get(DOMAIN, {}).get("auth_brokers", {}).pop(entry.entry_id, None)
+    await Store(hass, SNAPSHOT_STORAGE_VERSION, _snapshot_key(entry)).async_remove()
@@ -1,5 +1,6 @@
 import logging
-from homeassistant.components.binary_sensor import BinarySensorEntity
+from homeassistant.components.binary_sensor import BinarySensorDeviceClass, BinarySensorEntity
+from homeassistant.core import callback
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
 from homeassistant.helpers.device_registry import DeviceInfo
 from .const import DOMAIN
@@ -8,11 +9,26 @@ _LOGGER = logging.getLogger(__name__)
 
 async def async_setup_entry(hass, entry, async_add_entities):
     # Initialize the binary sensors for Tado Assist
-    coordinator = hass.data[DOMAIN][entry.entry_id]
+    entry_data = hass.data[DOMAIN][entry.entry_id]
+    coordinator = entry_data["coordinator"]
     async_add_entities([
         TadoHomeStateSensor(entry, coordinator),
         TadoOpenWindowSensor(entry, coordinator)
-    ], True)
+    ])
+
+    # Un sensore di presenza per ogni dispositivo mobile, aggiunto quando compare nei dati di Tado
+    known_devices = set()
+
+    @callback
+    def _async_add_mobile_devices():
+        device_states = (coordinator.data or {}).get("mobile_device_states", {})
+        new_devices = [device_id for device_id in device_states if device_id not in known_devices]
+        if new_devices:
+            known_devices.update(new_devices)
+            async_add_entities(TadoMobileDeviceSensor(entry, coordinator, device_id) for device_id in new_devices)
+
+    _async_add_mobile_devices()
+    entry.async_on_unload(coordinator.async_add_listener(_async_add_mobile_devices))
 
 class TadoBaseBinarySensor(CoordinatorEntity, BinarySensorEntity):  
     # Base class for all Tado binary sensors
@@ -22,7 +38,13 @@ class TadoBaseBinarySensor(CoordinatorEntity, BinarySensorEntity):
         self._attr_has_entity_name = True
         self._attr_unique_id = f"{entry.entry_id}_{unique_id}"
         self._attr_translation_key = translation_key
-        
+
+    @callback
+    def _handle_coordinator_update(self):
+        # Traccia il tempo speso a scrivere lo stato dopo ogni poll
+        with self.hass.data[DOMAIN][self._entry.entry_id]["tado"].tracer.span("entity_write", entity_id=self.entity_id):
+            super()._handle_coordinator_update()
+
     @property
     def device_info(self) -> DeviceInfo:
         # Provide device details for Home Assistant
@@ -69,9 +91,39 @@ class TadoOpenWindowSensor(TadoBaseBinarySensor):
     @property
     def extra_state_attributes(self):
         # Provide additional attributes such as the list of zones with open windows
+        attributes = {}
         open_window_zone_names = self.coordinator.data.get("open_window_zone_names", [])
         if isinstance(open_window_zone_names, list) and open_window_zone_names:
-            return {"windows_open_zones": open_window_zone_names}
-        else:
-            return {}
+            attributes["windows_open_zones"] = open_window_zone_names
+        window_episodes = self.coordinator.data.get("window_episodes")
+        if window_episodes:
+            attributes["window_episodes"] = window_episodes
+        return attributes
+
+class TadoMobileDeviceSensor(TadoBaseBinarySensor):
+    # Binary sensor reporting whether a single mobile device is at home
+    def __init__(self, entry, coordinator, device_id):
+        super().__init__(entry, coordinator, "tado_binary_mobile_device", f"mobile_device_{device_id}")
+        self._device_id = device_id
+        self._attr_device_class = BinarySensorDeviceClass.PRESENCE
+        self._attr_translation_placeholders = {"name": self._device.get("name", device_id)}
+
+    @property
+    def _device(self):
+        return (self.coordinator.data or {}).get("mobile_device_states", {}).get(self._device_id, {})
 
+    @property
+    def available(self):
+        return super().available and bool(self._device)
+
+    @property
+    def is_on(self):
+        # Determine if the mobile device is currently at home
+        if not self._device:
+            return None
+        return self._device.get("at_home")
+
+    @property
+    def extra_state_attributes(self):
+        # Provide whether geolocation is enabled for this device
+        return {"geo_tracking_enabled": self._device.get("geo_tracking", False)}
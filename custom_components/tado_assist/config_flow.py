@@ -13,7 +13,17 @@ from homeassistant.helpers.selector import (
     TextSelectorType,
 )
 
-from .const import DOMAIN, DEFAULT_SCAN_INTERVAL, MIN_SCAN_INTERVAL, CONF_API_URL, DEFAULT_API_URL
+from .const import (
+    DOMAIN,
+    DEFAULT_SCAN_INTERVAL,
+    MIN_SCAN_INTERVAL,
+    CONF_API_URL,
+    DEFAULT_API_URL,
+    CONF_MIN_OPEN_DURATION,
+    DEFAULT_MIN_OPEN_DURATION,
+    CONF_QUOTA_RESERVE,
+    DEFAULT_QUOTA_RESERVE,
+)
 from .tado_api import TadoAPI
 
 _LOGGER = logging.getLogger(__name__)
@@ -29,10 +39,14 @@ class TadoAssistOptionsFlowHandler(config_entries.OptionsFlow):
         
         current_interval = DEFAULT_SCAN_INTERVAL
         current_api_url = DEFAULT_API_URL
+        current_min_open_duration = DEFAULT_MIN_OPEN_DURATION
+        current_quota_reserve = DEFAULT_QUOTA_RESERVE
         
         if entry and hasattr(entry, "data"):
             current_interval = entry.data.get(CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL)
             current_api_url = entry.data.get(CONF_API_URL, DEFAULT_API_URL)
+            current_min_open_duration = entry.data.get(CONF_MIN_OPEN_DURATION, DEFAULT_MIN_OPEN_DURATION)
+            current_quota_reserve = entry.data.get(CONF_QUOTA_RESERVE, DEFAULT_QUOTA_RESERVE)
         
         if user_input is not None:
             if entry:
@@ -41,7 +55,9 @@ class TadoAssistOptionsFlowHandler(config_entries.OptionsFlow):
                     data={
                         **entry.data, 
                         CONF_SCAN_INTERVAL: user_input["scan_interval"],
-                        CONF_API_URL: user_input.get(CONF_API_URL, DEFAULT_API_URL)
+                        CONF_API_URL: user_input.get(CONF_API_URL, DEFAULT_API_URL),
+                        CONF_MIN_OPEN_DURATION: user_input.get(CONF_MIN_OPEN_DURATION, DEFAULT_MIN_OPEN_DURATION),
+                        CONF_QUOTA_RESERVE: user_input.get(CONF_QUOTA_RESERVE, DEFAULT_QUOTA_RESERVE)
                     }
                 )
             return self.async_create_entry(title="", data=user_input)
@@ -60,6 +76,23 @@ class TadoAssistOptionsFlowHandler(config_entries.OptionsFlow):
                 ),
                 vol.Required(CONF_API_URL, default=current_api_url): TextSelector(
                     TextSelectorConfig(type=TextSelectorType.URL)
+                ),
+                vol.Required(CONF_MIN_OPEN_DURATION, default=int(current_min_open_duration)): NumberSelector(
+                    NumberSelectorConfig(
+                        min=0,
+                        max=3600,
+                        step=1,
+                        mode=NumberSelectorMode.BOX,
+                        unit_of_measurement=UnitOfTime.SECONDS
+                    )
+                ),
+                vol.Required(CONF_QUOTA_RESERVE, default=int(current_quota_reserve)): NumberSelector(
+                    NumberSelectorConfig(
+                        min=0,
+                        max=100,
+                        step=1,
+                        mode=NumberSelectorMode.BOX
+                    )
                 )
             })
         )
@@ -135,6 +168,8 @@ class TadoAssistConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
     async def async_step_config(self, user_input=None):
         if user_input is not None:
+            # Il setup della nuova entry riusa token e home_id del flow invece di ripetere refresh e /me
+            self.tado.async_hand_over_auth()
             return self.async_create_entry(
                 title="Tado Assist",
                 data={
@@ -14,4 +14,50 @@ TADO_CLIENT_ID = "1bb50063-6b0c-4d11-bd99-387f4a91cc46"
 
 # Impostazioni API
 CONF_API_URL = "api_url"
-DEFAULT_API_URL = "https://my.tado.com/api/v2"
\ No newline at end of file
+DEFAULT_API_URL = "https://my.tado.com/api/v2"
+# Non esposto nella UI: usato per puntare l'auth a un server di test (es. load test)
+CONF_OAUTH_URL = "oauth_url"
+DEFAULT_OAUTH_URL = "https://login.tado.com/oauth2"
+
+# Piattaforme caricate dall'integrazione
+PLATFORMS = ["binary_sensor", "switch"]
+
+# Snapshot dell'ultimo poll salvato su disco per velocizzare l'avvio
+SNAPSHOT_STORAGE_VERSION = 1
+SNAPSHOT_SAVE_DELAY = 60
+
+# Profilazione del ciclo di polling
+SERVICE_CAPTURE_PROFILE = "capture_profile"
+ATTR_POLLS = "polls"
+DEFAULT_PROFILE_POLLS = 5
+ATTR_CONFIG_ENTRY_ID = "config_entry_id"
+ATTR_TIMEOUT = "timeout"
+# Se i poll non arrivano (assistente spento, quota in riserva) la cattura termina con un report parziale
+DEFAULT_PROFILE_TIMEOUT = 1800
+EVENT_PROFILE_READY = f"{DOMAIN}_profile_ready"
+
+# Pool condiviso di polling per più account Tado
+FLEET_MAX_CONCURRENCY = 4
+FLEET_STARTUP_SPREAD = 60
+FLEET_MAX_BACKOFF = 3600
+
+# Anticipo (secondi) con cui rinnovare l'access token prima della scadenza comunicata da Tado
+ACCESS_TOKEN_EXPIRY_MARGIN = 30
+
+# Durata minima (secondi) di una finestra aperta prima di sospendere il riscaldamento
+CONF_MIN_OPEN_DURATION = "min_open_duration"
+DEFAULT_MIN_OPEN_DURATION = 60
+
+# Storico in memoria degli ultimi poll (diagnostica)
+HISTORY_SIZE = 100
+SERVICE_DUMP_HISTORY = "dump_history"
+ATTR_EXPAND = "expand"
+
+# Controllo di ammissione delle chiamate quando la quota giornaliera sta per finire
+CONF_QUOTA_RESERVE = "quota_reserve"
+DEFAULT_QUOTA_RESERVE = 5
+# Richieste extra oltre la riserva sotto cui i poll vengono fermati (prima delle scritture automatiche)
+QUOTA_POLL_HEADROOM = 5
+PRIORITY_USER = "user"
+PRIORITY_AUTOMATION = "automation"
+PRIORITY_POLL = "poll"
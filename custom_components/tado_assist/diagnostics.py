@@ -0,0 +1,41 @@
+"""Diagnostics support for Tado Assist."""
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN
+
+# Token, id della casa e nomi scelti dall'utente (telefoni, zone) non devono finire nei download condivisi
+TO_REDACT = {"refresh_token", "access_token", "home_id", "name", "zone_name", "open_window_zone_names"}
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> dict:
+    """Return diagnostics for a config entry, including the recent poll history."""
+    entry_data = hass.data[DOMAIN].get(entry.entry_id, {})
+    tado = entry_data.get("tado")
+    history = tado.history.as_dict() if tado else None
+    if history:
+        history = {
+            **history,
+            "base": _redact_poll(history["base"]),
+            "entries": [{**item, "changes": _redact_poll(item["changes"])} for item in history["entries"]],
+        }
+    return {
+        "entry": async_redact_data(dict(entry.data), TO_REDACT),
+        "last_data": _redact_poll(entry_data.get("last_data")),
+        "history": history,
+    }
+
+
+def _redact_poll(data):
+    """Oscura i dati di un poll; gli snapshot salvati prima dell'indicizzazione per id vengono reindicizzati."""
+    if not data:
+        return data
+    data = async_redact_data(data, TO_REDACT)
+    episodes = data.get("window_episodes")
+    if isinstance(episodes, dict):
+        data["window_episodes"] = {
+            str(episode.get("zone_id", f"zone_{index}")): episode for index, episode in enumerate(episodes.values())
+        }
+    return data
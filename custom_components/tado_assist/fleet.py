@@ -0,0 +1,152 @@
+"""Scheduler condiviso che esegue i poll di tutti gli account Tado configurati."""
+
+import asyncio
+import hashlib
+import heapq
+import itertools
+import logging
+import time
+
+from homeassistant.core import HomeAssistant, callback
+
+from .const import DOMAIN, FLEET_MAX_BACKOFF, FLEET_STARTUP_SPREAD, PRIORITY_POLL
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _FleetAccount:
+    """Stato di scheduling di un singolo account (config entry)."""
+
+    def __init__(self, entry_id, coordinator, tado, interval):
+        self.entry_id = entry_id
+        self.coordinator = coordinator
+        self.tado = tado
+        self.interval = interval
+        self.failures = 0
+        self.poll_cost = 0
+        # Fase deterministica nell'intervallo: all'avvio e a regime gli account non partono tutti nello stesso istante
+        digest = hashlib.sha1(entry_id.encode()).digest()
+        self.phase = int.from_bytes(digest[:4], "big") / 0xFFFFFFFF
+
+
+class TadoFleetScheduler:
+    """Un unico task esegue i poll di tutti gli account, con un limite globale di poll concorrenti.
+
+    I coordinator vengono creati senza update_interval: è lo scheduler a decidere quando aggiornarli,
+    rispettando l'intervallo, la quota giornaliera e il backoff di ogni account.
+    """
+
+    def __init__(self, hass: HomeAssistant, max_concurrency):
+        self.hass = hass
+        self._accounts = {}
+        self._queue = []
+        self._sequence = itertools.count()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    @callback
+    def async_register(self, entry_id, coordinator, tado, interval):
+        """Aggiunge un account al pool e restituisce la funzione per rimuoverlo."""
+        account = _FleetAccount(entry_id, coordinator, tado, interval)
+        self._accounts[entry_id] = account
+        self._schedule(account, account.phase * min(interval, FLEET_STARTUP_SPREAD))
+
+        if self._task is None:
+            self._task = self.hass.async_create_background_task(self._async_run(), f"{DOMAIN}_fleet_scheduler")
+
+        @callback
+        def _unregister():
+            if self._accounts.get(entry_id) is account:
+                del self._accounts[entry_id]
+            if not self._accounts and self._task is not None:
+                self._task.cancel()
+                self._task = None
+                self._queue.clear()
+
+        return _unregister
+
+    def _schedule(self, account, delay):
+        heapq.heappush(self._queue, (time.monotonic() + delay, next(self._sequence), account))
+        self._wakeup.set()
+
+    async def _async_run(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            due, _, account = self._queue[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._queue)
+            if self._accounts.get(account.entry_id) is not account:
+                continue
+
+            # Il semaforo viene acquisito prima di creare il task: al massimo N poll (e socket) attivi
+            await self._semaphore.acquire()
+            self.hass.async_create_background_task(
+                self._async_poll(account), f"{DOMAIN}_fleet_poll_{account.entry_id}"
+            )
+
+    async def _async_poll(self, account):
+        try:
+            delay = self._quota_delay(account)
+            if delay:
+                _LOGGER.info(
+                    "Quota Tado quasi esaurita per %s (%s richieste residue), poll rimandato di %ss.",
+                    account.entry_id, account.tado.quota_remaining, int(delay),
+                )
+                account.tado.history.record_failure(
+                    "quota", f"{account.tado.quota_remaining} richieste residue, poll rimandato di {int(delay)}s"
+                )
+                self._schedule(account, delay)
+                return
+
+            requests_before = account.tado.request_count
+            await account.coordinator.async_refresh()
+            account.poll_cost = max(account.poll_cost, account.tado.request_count - requests_before)
+
+            if account.coordinator.last_update_success:
+                account.failures = 0
+            else:
+                account.failures += 1
+
+            if account.failures > 1:
+                # Backoff esponenziale per account dal secondo errore consecutivo: un account
+                # in errore o in 429 non rallenta gli altri, un errore isolato si riprova al giro dopo
+                delay = min(account.interval * 2 ** (account.failures - 1), FLEET_MAX_BACKOFF)
+            else:
+                delay = self._next_slot_delay(account)
+
+            if self._accounts.get(account.entry_id) is account:
+                self._schedule(account, delay)
+        finally:
+            self._semaphore.release()
+
+    @staticmethod
+    def _next_slot_delay(account):
+        """Secondi fino al prossimo slot dell'account: ogni account ha un offset fisso (phase * interval) nell'intervallo."""
+        offset = account.phase * account.interval
+        delay = account.interval - (time.monotonic() - offset) % account.interval
+        # Un poll terminato appena prima del proprio slot non viene ripetuto subito
+        return delay if delay >= account.interval / 2 else delay + account.interval
+
+    def _quota_delay(self, account):
+        """Secondi da attendere se la quota residua non basta per un poll completo oltre la riserva."""
+        tado = account.tado
+        # Il poll deve poter terminare senza scendere sotto la soglia riservata a utente e automazioni
+        required = max(account.poll_cost, 1) + tado.admission.threshold(PRIORITY_POLL)
+        if tado.quota_remaining is None or tado.quota_remaining >= required:
+            return 0
+        if tado.quota_reset_at is None:
+            return account.interval
+        return max(tado.quota_reset_at - time.monotonic(), account.interval)
@@ -0,0 +1,79 @@
+"""Storico in memoria, a dimensione fissa, degli ultimi poll di Tado Assist."""
+
+from collections import deque
+from copy import deepcopy
+
+from homeassistant.util import dt as dt_util
+
+from .const import HISTORY_SIZE
+
+
+class TadoPollHistory:
+    """Ring buffer dei risultati dei poll salvati come differenze rispetto al poll precedente.
+
+    Ogni voce contiene solo le chiavi cambiate (e quelle rimosse) più le azioni eseguite
+    dall'integrazione da un poll all'altro; i poll falliti o saltati hanno una voce senza
+    modifiche con il motivo in "failure". Quando la voce più vecchia esce dal buffer viene
+    applicata alla base, così base + voci permette sempre di ricostruire ogni snapshot.
+    """
+
+    def __init__(self, size=HISTORY_SIZE):
+        self._entries = deque()
+        self._size = size
+        self._base = {}
+        self._latest = {}
+        self._pending_actions = []
+
+    def record_action(self, action, **details):
+        """Registra una scrittura verso Tado; viene allegata alla prossima voce dello storico."""
+        self._pending_actions.append({"time": dt_util.utcnow().isoformat(), "action": action, **details})
+
+    def record_poll(self, data):
+        """Aggiunge al buffer la differenza tra questo poll e il precedente."""
+        changes = {key: deepcopy(value) for key, value in data.items() if self._latest.get(key) != value}
+        removed = [key for key in self._latest if key not in data]
+        self._append(changes, removed)
+
+    def record_failure(self, reason, error=None):
+        """Registra un poll fallito o saltato (errore, autenticazione, quota) senza dati nuovi."""
+        self._append({}, [], failure={"reason": reason, "error": str(error) if error else None})
+
+    def _append(self, changes, removed, **extra):
+        if len(self._entries) >= self._size:
+            _apply(self._base, self._entries.popleft())
+
+        self._entries.append({
+            "time": dt_util.utcnow().isoformat(),
+            "changes": changes,
+            "removed": removed,
+            "actions": self._pending_actions,
+            **extra,
+        })
+        self._pending_actions = []
+        _apply(self._latest, self._entries[-1])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def as_dict(self, expand=False):
+        """Esporta lo storico; con expand=True ogni voce contiene anche lo snapshot completo."""
+        entries = list(self._entries)
+        if expand:
+            snapshot = deepcopy(self._base)
+            expanded = []
+            for entry in entries:
+                _apply(snapshot, entry)
+                expanded.append({**entry, "snapshot": deepcopy(snapshot)})
+            entries = expanded
+        return {
+            "size": self._size,
+            "base": self._base,
+            "entries": entries,
+            "pending_actions": self._pending_actions,
+        }
+
+
+def _apply(snapshot, entry):
+    snapshot.update(deepcopy(entry["changes"]))
+    for key in entry["removed"]:
+        snapshot.pop(key, None)
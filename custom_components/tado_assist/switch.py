@@ -1,28 +1,37 @@
 import logging
 from homeassistant.components.switch import SwitchEntity
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
 from homeassistant.helpers.device_registry import DeviceInfo
 from homeassistant.helpers.restore_state import RestoreEntity
 from homeassistant.exceptions import HomeAssistantError
 
-from .const import DOMAIN
+from .const import DOMAIN, CONF_MIN_OPEN_DURATION, DEFAULT_MIN_OPEN_DURATION, PRIORITY_POLL, PRIORITY_USER
 
 _LOGGER = logging.getLogger(__name__)
 
 async def async_setup_entry(hass, entry, async_add_entities):
     # Set up the switches for Tado Assist
-    coordinator = hass.data[DOMAIN][entry.entry_id]
-    tado = hass.data[DOMAIN]["tado"]
+    entry_data = hass.data[DOMAIN][entry.entry_id]
+    coordinator = entry_data["coordinator"]
+    tado = entry_data["tado"]
+
+    georeferencing_switch = TadoGeoreferencingSwitch(hass, entry, coordinator, tado)
+    window_control_switch = TadoWindowControlSwitch(hass, entry, coordinator, tado)
 
     switches = [
         TadoEnabledAssistSwitch(hass, entry, coordinator),
-        TadoGeoreferencingSwitch(hass, entry, coordinator, tado),
-        TadoWindowControlSwitch(hass, entry, coordinator, tado),
+        georeferencing_switch,
+        window_control_switch,
         TadoAwaySwitch(hass, entry, coordinator, tado)
     ]
 
-    async_add_entities(switches, True)
-    hass.data[DOMAIN]["switch_entities"] = switches
+    async_add_entities(switches)
+    entry_data["switch_entities"] = switches
+    # Riferimenti diretti usati dal coordinator, così __init__ non deve importare questa piattaforma
+    entry_data["georeferencing_switch"] = georeferencing_switch
+    entry_data["window_control_switch"] = window_control_switch
 
 class TadoBaseSwitch(CoordinatorEntity, SwitchEntity, RestoreEntity):  
     # Base class for Tado switches
@@ -45,6 +54,12 @@ class TadoBaseSwitch(CoordinatorEntity, SwitchEntity, RestoreEntity):
             self._attr_is_on = False
         self.async_write_ha_state()
 
+    @callback
+    def _handle_coordinator_update(self):
+        # Traccia il tempo speso a scrivere lo stato dopo ogni poll
+        with self.hass.data[DOMAIN][self._entry.entry_id]["tado"].tracer.span("entity_write", entity_id=self.entity_id):
+            super()._handle_coordinator_update()
+
     @property
     def device_info(self) -> DeviceInfo:
         # Return device information for the Tado Assist device
@@ -68,18 +83,18 @@ class TadoEnabledAssistSwitch(TadoBaseSwitch):
     async def async_added_to_hass(self):
         """Sincronizza lo stato ripristinato con la variabile globale al riavvio."""
         await super().async_added_to_hass()
-        self.hass.data[DOMAIN]["tado_assist_status"] = self._attr_is_on
+        self.hass.data[DOMAIN][self._entry.entry_id]["tado_assist_status"] = self._attr_is_on
 
     async def async_turn_on(self, **kwargs):
         self._attr_is_on = True
-        self.hass.data[DOMAIN]["tado_assist_status"] = True
+        self.hass.data[DOMAIN][self._entry.entry_id]["tado_assist_status"] = True
         self.async_write_ha_state()
         # Forza aggiornamento dati immediato
         await self.coordinator.async_request_refresh()
 
     async def async_turn_off(self, **kwargs):
         self._attr_is_on = False
-        self.hass.data[DOMAIN]["tado_assist_status"] = False
+        self.hass.data[DOMAIN][self._entry.entry_id]["tado_assist_status"] = False
         self.async_write_ha_state()
 
 class TadoGeoreferencingSwitch(TadoBaseSwitch):
@@ -95,12 +110,15 @@ class TadoGeoreferencingSwitch(TadoBaseSwitch):
     async def async_added_to_hass(self):
         """Sincronizza lo stato ripristinato con la variabile globale al riavvio."""
         await super().async_added_to_hass()
-        self.hass.data[DOMAIN]["tado_georeferencing_status"] = self._attr_is_on
+        self.hass.data[DOMAIN][self._entry.entry_id]["tado_georeferencing_status"] = self._attr_is_on
 
     async def async_turn_on(self, **kwargs):
         self._attr_is_on = True
-        self.hass.data[DOMAIN]["tado_georeferencing_status"] = True
+        self.hass.data[DOMAIN][self._entry.entry_id]["tado_georeferencing_status"] = True
         self.async_write_ha_state()
+        # Finché non c'è un poll reale i dati sono quelli dello snapshot su disco: nessuna scrittura
+        if not self.hass.data[DOMAIN][self._entry.entry_id].get("live_data"):
+            return
         try:
             await self.async_check_and_set_home_or_away()
         except Exception as e:
@@ -108,26 +126,30 @@ class TadoGeoreferencingSwitch(TadoBaseSwitch):
 
     async def async_turn_off(self, **kwargs):
         self._attr_is_on = False
-        self.hass.data[DOMAIN]["tado_georeferencing_status"] = False
+        self.hass.data[DOMAIN][self._entry.entry_id]["tado_georeferencing_status"] = False
         self.async_write_ha_state()
 
-    async def async_check_and_set_home_or_away(self):
-        # Update home/away status based on georeferencing data
+    async def async_check_and_set_home_or_away(self, data=None):
+        # Update home/away status based on georeferencing data (the current poll result, if given)
         if self._attr_is_on:
-            home_state = self.coordinator.data.get("home_state", {})
-            devices_at_home = self.coordinator.data.get("mobile_devices", 0)
+            data = data if data is not None else self.coordinator.data
+            home_state = data.get("home_state", {})
+            devices_at_home = data.get("mobile_devices", 0)
             if home_state.get("presence") == "HOME" and devices_at_home == 0:
                 _LOGGER.info("No mobile devices at home, setting AWAY mode...")
-                await self.tado.set_away() 
+                with self.tado.tracer.span("switch_action", action="geo_set_away"):
+                    await self.tado.set_away()
             elif home_state.get("presence") == "AWAY" and devices_at_home > 0:
                 _LOGGER.info("Mobile devices detected at home, setting HOME mode...")
-                await self.tado.set_home() 
+                with self.tado.tracer.span("switch_action", action="geo_set_home"):
+                    await self.tado.set_home()
 
 class TadoWindowControlSwitch(TadoBaseSwitch):
     # Switch to enable or disable automatic window control
     def __init__(self, hass, entry, coordinator, tado):
         super().__init__(hass, entry, coordinator, "tado_switch_auto_window_control", "window_control_switch")
         self.tado = tado
+        self._recheck_unsub = None
 
     @property
     def is_on(self):
@@ -136,11 +158,12 @@ class TadoWindowControlSwitch(TadoBaseSwitch):
     async def async_added_to_hass(self):
         """Sincronizza lo stato ripristinato con la variabile globale al riavvio."""
         await super().async_added_to_hass()
-        self.hass.data[DOMAIN]["tado_window_control_status"] = self._attr_is_on
+        self.hass.data[DOMAIN][self._entry.entry_id]["tado_window_control_status"] = self._attr_is_on
+        self.async_on_remove(self._async_cancel_recheck)
 
     async def async_turn_on(self, **kwargs):
         self._attr_is_on = True
-        self.hass.data[DOMAIN]["tado_window_control_status"] = True
+        self.hass.data[DOMAIN][self._entry.entry_id]["tado_window_control_status"] = True
         self.async_write_ha_state()
         try:
             await self.async_check_and_pause_thermostat()
@@ -149,16 +172,44 @@ class TadoWindowControlSwitch(TadoBaseSwitch):
 
     async def async_turn_off(self, **kwargs):
         self._attr_is_on = False
-        self.hass.data[DOMAIN]["tado_window_control_status"] = False
+        self.hass.data[DOMAIN][self._entry.entry_id]["tado_window_control_status"] = False
+        self._async_cancel_recheck()
         self.async_write_ha_state()
 
     async def async_check_and_pause_thermostat(self):
-        # Pause heating in areas where open windows are detected
+        # Pause heating once per open-window episode, only after the minimum open duration
         if self._attr_is_on:
-            open_window_zone_ids = self.coordinator.data.get("open_window_zone_ids", [])
-            for zone_id in open_window_zone_ids:
+            episodes = self.hass.data[DOMAIN][self._entry.entry_id]["window_episodes"]
+            min_open_duration = self._entry.data.get(CONF_MIN_OPEN_DURATION, DEFAULT_MIN_OPEN_DURATION)
+            for zone_id in episodes.zones_to_suspend(min_open_duration):
                 _LOGGER.info("Activating temporary heating suspension for zone %s", zone_id)
-                await self.tado.set_open_window(zone_id) 
+                with self.tado.tracer.span("switch_action", action="set_open_window", zone_id=zone_id):
+                    await self.tado.set_open_window(zone_id)
+                episodes.mark_suspended(zone_id)
+            self._async_schedule_recheck(episodes.seconds_until_due(min_open_duration))
+
+    @callback
+    def _async_schedule_recheck(self, delay):
+        """Ricontrolla le finestre quando la prima raggiunge la durata minima, senza attendere il prossimo poll."""
+        self._async_cancel_recheck()
+        if delay is not None:
+            self._recheck_unsub = async_call_later(self.hass, delay, self._async_recheck)
+
+    @callback
+    def _async_cancel_recheck(self):
+        if self._recheck_unsub:
+            self._recheck_unsub()
+            self._recheck_unsub = None
+
+    async def _async_recheck(self, _now):
+        self._recheck_unsub = None
+        if not self.hass.data[DOMAIN][self._entry.entry_id]["tado_assist_status"]:
+            return
+        try:
+            await self.async_check_and_pause_thermostat()
+        except Exception as e:
+            # Riprova comunque al prossimo poll
+            _LOGGER.warning("Sospensione del riscaldamento non riuscita: %s", e)
 
 class TadoAwaySwitch(TadoBaseSwitch):
     """
@@ -186,15 +237,25 @@ class TadoAwaySwitch(TadoBaseSwitch):
         # Se non ci sono dati (es. appena avviato), usa lo stato salvato internamente
         return self._attr_is_on
 
+    async def _async_presence_set(self, presence):
+        """Allinea i dati del coordinator al comando accettato da Tado, poi chiede un refresh se la quota lo permette."""
+        entry_data = self.hass.data[DOMAIN][self._entry.entry_id]
+        data = dict(self.coordinator.data or {})
+        data["home_state"] = {**data.get("home_state", {}), "presence": presence}
+        entry_data["last_data"] = data
+        self.coordinator.async_set_updated_data(data)
+        # Con la quota nella riserva un poll verrebbe rifiutato e riporterebbe i dati precedenti
+        if self.tado.admission.admits(PRIORITY_POLL, self.tado.quota_remaining):
+            await self.coordinator.async_request_refresh()
+
     async def async_turn_on(self, **kwargs):
         """Utente mette su ON -> Imposta AWAY."""
         try:
             _LOGGER.info("Manually setting Tado to AWAY mode.")
-            await self.tado.set_away()
+            with self.tado.tracer.span("switch_action", action="manual_set_away"):
+                await self.tado.set_away(priority=PRIORITY_USER)
             self._attr_is_on = True
-            self.async_write_ha_state()
-            # Richiede refresh immediato per allineare UI
-            await self.coordinator.async_request_refresh()
+            await self._async_presence_set("AWAY")
         except Exception as e:
             raise HomeAssistantError(f"Impossibile comunicare con Tado: {e}")
 
@@ -202,10 +263,9 @@ class TadoAwaySwitch(TadoBaseSwitch):
         """Utente mette su OFF -> Imposta HOME."""
         try:
             _LOGGER.info("Manually setting Tado to HOME mode.")
-            await self.tado.set_home()
+            with self.tado.tracer.span("switch_action", action="manual_set_home"):
+                await self.tado.set_home(priority=PRIORITY_USER)
             self._attr_is_on = False
-            self.async_write_ha_state()
-            # Richiede refresh immediato per allineare UI
-            await self.coordinator.async_request_refresh()
+            await self._async_presence_set("HOME")
         except Exception as e:
             raise HomeAssistantError(f"Impossibile comunicare con Tado: {e}")
\ No newline at end of file
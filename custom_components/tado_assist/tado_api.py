@@ -1,13 +1,36 @@
 import logging
 import asyncio
+import re
+import time
 from typing import Optional
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers import issue_registry as ir
 
-from .const import TADO_CLIENT_ID, CONF_API_URL, DEFAULT_API_URL
+from .const import (
+    DOMAIN,
+    TADO_CLIENT_ID,
+    CONF_API_URL,
+    DEFAULT_API_URL,
+    CONF_OAUTH_URL,
+    DEFAULT_OAUTH_URL,
+    ACCESS_TOKEN_EXPIRY_MARGIN,
+    CONF_QUOTA_RESERVE,
+    DEFAULT_QUOTA_RESERVE,
+    QUOTA_POLL_HEADROOM,
+    PRIORITY_USER,
+    PRIORITY_AUTOMATION,
+    PRIORITY_POLL,
+)
+from .history import TadoPollHistory
+from .tracing import TadoTracer
 
 _LOGGER = logging.getLogger(__name__)
 
+# Header di quota restituito da Tado, es: "perday";r=94;t=3600
+_RATELIMIT_REMAINING = re.compile(r"\br=(\d+)")
+_RATELIMIT_RESET = re.compile(r"\bt=(\d+)")
+
 class TadoAuthError(Exception):
     """Eccezione sollevata quando l'autenticazione fallisce in modo irrecuperabile."""
     pass
@@ -16,32 +39,282 @@ class TadoApiError(Exception):
     """Eccezione sollevata per errori generici dell'API."""
     pass
 
-class TadoAPI:
-    def __init__(self, hass: HomeAssistant, config_entry=None, refresh_token=None):
+class TadoQuotaError(TadoApiError):
+    """Eccezione sollevata quando una chiamata viene rifiutata per preservare la quota giornaliera."""
+    pass
+
+class TadoAdmissionController:
+    """Ammette le chiamate in base alla priorità quando la quota giornaliera di Tado sta per finire.
+
+    Le ultime `reserve` richieste sono riservate ai comandi dell'utente: i poll vengono fermati per
+    primi, poi le scritture automatiche. Quando un comando utente inizia a consumare la riserva
+    viene aperto un problema nelle riparazioni di HA, chiuso quando la quota torna disponibile.
+    """
+
+    def __init__(self, hass: HomeAssistant, config_entry=None):
+        self.hass = hass
+        self.config_entry = config_entry
+        self._issue_active = False
+
+    @property
+    def reserve(self):
+        if self.config_entry and self.config_entry.data:
+            return int(self.config_entry.data.get(CONF_QUOTA_RESERVE, DEFAULT_QUOTA_RESERVE))
+        return DEFAULT_QUOTA_RESERVE
+
+    def threshold(self, priority):
+        """Quota residua minima sotto la quale le chiamate di questa priorità vengono rifiutate."""
+        if priority == PRIORITY_USER:
+            return 0
+        if priority == PRIORITY_AUTOMATION:
+            return self.reserve
+        return self.reserve + QUOTA_POLL_HEADROOM
+
+    def admits(self, priority, remaining):
+        """True se una chiamata di questa priorità verrebbe ammessa con la quota residua."""
+        return remaining is None or priority == PRIORITY_USER or remaining > self.threshold(priority)
+
+    @callback
+    def async_admit(self, priority, remaining):
+        """Solleva TadoQuotaError se la chiamata non può essere eseguita con la quota residua."""
+        if remaining is None:
+            return
+
+        if not self.admits(priority, remaining):
+            raise TadoQuotaError(
+                f"Quota Tado quasi esaurita ({remaining} richieste residue): chiamata '{priority}' rimandata."
+            )
+
+        if priority == PRIORITY_USER and remaining <= self.reserve:
+            self._async_update_issue(remaining)
+
+    @callback
+    def async_quota_updated(self, remaining):
+        """Chiude il problema di riserva quando la quota torna sopra la riserva (es. dopo il reset)."""
+        if self._issue_active and (remaining is None or remaining > self.reserve):
+            self._issue_active = False
+            ir.async_delete_issue(self.hass, DOMAIN, self._issue_id)
+
+    @property
+    def _issue_id(self):
+        entry_id = self.config_entry.entry_id if self.config_entry else "setup"
+        return f"quota_reserve_in_use_{entry_id}"
+
+    @callback
+    def _async_update_issue(self, remaining):
+        if self._issue_active or not self.config_entry:
+            return
+        _LOGGER.warning("Quota Tado nella riserva per i comandi utente: %s richieste residue.", remaining)
+        self._issue_active = True
+        ir.async_create_issue(
+            self.hass,
+            DOMAIN,
+            self._issue_id,
+            is_fixable=False,
+            severity=ir.IssueSeverity.WARNING,
+            translation_key="quota_reserve_in_use",
+            translation_placeholders={"remaining": str(remaining), "reserve": str(self.reserve)},
+        )
+
+
+class TadoAuthBroker:
+    """Possiede i token di un account Tado e li condivide tra tutti i consumer.
+
+    L'entry in esecuzione e i config flow (es. reauth) dello stesso account usano la stessa
+    istanza: un solo refresh alla volta e ogni rotazione del refresh token viene salvata
+    subito nel config entry.
+    """
+
+    def __init__(self, hass: HomeAssistant, config_entry=None, refresh_token=None, oauth_url=DEFAULT_OAUTH_URL):
         self.hass = hass
         self.config_entry = config_entry
         self.refresh_token = refresh_token
         self.access_token = None
         self.home_id = None
+        self._expires_at = None
+        self._oauth_url = oauth_url
+        self._session = async_get_clientsession(hass)
+        self._refresh_lock = asyncio.Lock()
+
+    @property
+    def token_valid(self):
+        if not self.access_token:
+            return False
+        return self._expires_at is None or time.monotonic() < self._expires_at
+
+    async def async_get_access_token(self, tracer):
+        """Restituisce l'access token corrente, rinnovandolo solo se scaduto."""
+        if self.token_valid:
+            return self.access_token
+        return await self.async_refresh(tracer, only_if_expired=True)
+
+    async def async_refresh(self, tracer, stale_token=None, only_if_expired=False):
+        """Rinnova l'access token; se un altro consumer l'ha già rinnovato restituisce quello nuovo."""
+        async with self._refresh_lock:
+            if self.token_valid and (only_if_expired or self.access_token != stale_token):
+                return self.access_token
+
+            if not self.refresh_token:
+                raise TadoAuthError("Nessun refresh_token disponibile.")
+
+            url = f"{self._oauth_url}/token"
+            payload = {
+                "client_id": TADO_CLIENT_ID,
+                "grant_type": "refresh_token",
+                "refresh_token": self.refresh_token
+            }
+
+            with tracer.span("refresh_access_token") as span:
+                async with self._session.post(url, data=payload) as response:
+                    span.tags["status"] = response.status
+                    if response.status in [400, 401]:
+                        raise TadoAuthError("Refresh token rifiutato dal server.")
+                    elif response.status != 200:
+                        raise TadoApiError(f"Errore HTTP {response.status} durante il refresh.")
+
+                    data = await response.json()
+
+            self.async_set_tokens(data.get("access_token"), data.get("refresh_token"), data.get("expires_in"))
+            return self.access_token
+
+    @callback
+    def async_set_tokens(self, access_token, refresh_token=None, expires_in=None):
+        """Aggiorna i token e salva nel config entry l'eventuale nuovo refresh token."""
+        self.access_token = access_token
+        self._expires_at = (
+            time.monotonic() + max(int(expires_in) - ACCESS_TOKEN_EXPIRY_MARGIN, 0) if expires_in else None
+        )
+
+        if refresh_token and refresh_token != self.refresh_token:
+            self.refresh_token = refresh_token
+            # Aggiorna il config_entry se esiste
+            if self.config_entry and hasattr(self.config_entry, "entry_id"):
+                new_data = {**self.config_entry.data, "refresh_token": refresh_token}
+                self.hass.config_entries.async_update_entry(self.config_entry, data=new_data)
+
+
+@callback
+def async_get_auth_broker(hass: HomeAssistant, config_entry=None, refresh_token=None, oauth_url=DEFAULT_OAUTH_URL):
+    """Restituisce il broker condiviso dell'account; senza config entry (nuovo account) ne crea uno privato."""
+    if not config_entry or not hasattr(config_entry, "entry_id"):
+        return TadoAuthBroker(hass, None, refresh_token, oauth_url)
+
+    brokers = hass.data.setdefault(DOMAIN, {}).setdefault("auth_brokers", {})
+    broker = brokers.get(config_entry.entry_id)
+    if broker is None:
+        refresh_token = refresh_token or config_entry.data.get("refresh_token")
+        # Entry appena creata da un config flow: riusa il suo broker (access token e home_id già noti)
+        broker = hass.data[DOMAIN].get("pending_auth_brokers", {}).pop(refresh_token, None)
+        if broker is not None:
+            broker.config_entry = config_entry
+        else:
+            broker = TadoAuthBroker(hass, config_entry, refresh_token, oauth_url)
+        brokers[config_entry.entry_id] = broker
+    else:
+        # L'oggetto entry può cambiare dopo un reload: il broker salva sempre su quello corrente
+        broker.config_entry = config_entry
+        if not broker.refresh_token:
+            broker.refresh_token = refresh_token or config_entry.data.get("refresh_token")
+    return broker
+
+
+class TadoMobileDeviceRegistry:
+    """Dispositivi mobili della casa, indicizzati per id.
+
+    Serve a conoscere i dispositivi per cui creare i sensori di presenza; nome, impostazioni
+    e posizione vengono presi ad ogni poll dalla risposta di /mobileDevices appena ricevuta.
+    """
+
+    def __init__(self):
+        self.devices = {}
+
+    def update(self, payload):
+        """Aggiorna i dispositivi con la lista restituita da /mobileDevices."""
+        devices = {}
+        for d in (payload or []):
+            # Controlla che il dispositivo sia effettivamente un dizionario valido
+            if not isinstance(d, dict) or d.get("id") is None:
+                continue
+            device_id = str(d["id"])
+            # Usiamo "or {}" per prevenire i casi in cui l'API restituisce esplicitamente "null" (None in Python)
+            settings = d.get("settings") or {}
+            location = d.get("location") or {}
+            devices[device_id] = {
+                "name": d.get("name") or device_id,
+                "geo_tracking": bool(settings.get("geoTrackingEnabled")),
+                "at_home": bool(location.get("atHome")),
+            }
+        self.devices = devices
+
+    @property
+    def count_at_home(self):
+        """Numero di dispositivi con geolocalizzazione attiva che risultano in casa."""
+        return sum(1 for d in self.devices.values() if d["geo_tracking"] and d["at_home"])
+
+
+class TadoAPI:
+    def __init__(self, hass: HomeAssistant, config_entry=None, refresh_token=None):
+        self.hass = hass
+        self.config_entry = config_entry
+        self.home_id = None
         self._device_code = None
         
         # Endpoints Tado CORRETTI
-        self._oauth_url = "https://login.tado.com/oauth2"
+        self._oauth_url = DEFAULT_OAUTH_URL
         self._session = async_get_clientsession(self.hass)
         self._lock = asyncio.Lock()
+        self.tracer = TadoTracer(hass, config_entry.entry_id if config_entry else None)
+
+        # Quota giornaliera comunicata da Tado negli header e contatore delle chiamate effettuate
+        self.request_count = 0
+        self._quota_remaining = None
+        self.quota_reset_at = None
+
+        self.mobile_devices = TadoMobileDeviceRegistry()
+        self.history = TadoPollHistory()
+        self.admission = TadoAdmissionController(hass, config_entry)
 
         # Imposta l'URL personalizzato o quello di default se non presente
         self._api_url = DEFAULT_API_URL
         if self.config_entry and self.config_entry.data:
             self._api_url = self.config_entry.data.get(CONF_API_URL, DEFAULT_API_URL)
+            self._oauth_url = self.config_entry.data.get(CONF_OAUTH_URL, DEFAULT_OAUTH_URL)
+
+        # Token condivisi con le altre istanze dello stesso account
+        self._auth = async_get_auth_broker(hass, config_entry, refresh_token, self._oauth_url)
+
+    @property
+    def refresh_token(self):
+        return self._auth.refresh_token
+
+    @refresh_token.setter
+    def refresh_token(self, value):
+        self._auth.refresh_token = value
+
+    @property
+    def access_token(self):
+        return self._auth.access_token
+
+    @property
+    def quota_remaining(self):
+        """Richieste residue comunicate da Tado; None se sconosciute o se la quota è stata azzerata."""
+        if self.quota_reset_at and time.monotonic() >= self.quota_reset_at:
+            self._quota_remaining = None
+            self.quota_reset_at = None
+            self.admission.async_quota_updated(None)
+        return self._quota_remaining
 
     async def async_initialize(self, force_new=False):
         """Inizializza l'API. Se force_new è True o il refresh_token fallisce, avvia un nuovo login."""
         if self.refresh_token and not force_new:
             try:
                 _LOGGER.debug("Tentativo di login con refresh_token salvato...")
-                await self._refresh_access_token()
-                await self._fetch_me()
+                await self._auth.async_get_access_token(self.tracer)
+                # L'home_id è già noto se un'altra istanza dello stesso account ha chiamato /me
+                if self._auth.home_id:
+                    self.home_id = self._auth.home_id
+                else:
+                    await self._fetch_me()
                 return {"status": "COMPLETED", "auth_url": None}
             except TadoAuthError:
                 _LOGGER.warning("Refresh token scaduto o non valido. Necessario nuovo login.")
@@ -98,8 +371,9 @@ class TadoAPI:
                 data = await response.json()
                 
                 if response.status == 200:
-                    self.access_token = data.get("access_token")
-                    self.refresh_token = data.get("refresh_token")
+                    self._auth.async_set_tokens(
+                        data.get("access_token"), data.get("refresh_token"), data.get("expires_in")
+                    )
                     await self._fetch_me() # Recupera l'home_id
                     return True
                 elif data.get("error") == "authorization_pending":
@@ -112,84 +386,84 @@ class TadoAPI:
             _LOGGER.error("Errore di rete durante activate_device: %s", e)
             return False
 
-    async def _refresh_access_token(self):
-        """Rinnova l'access token usando il refresh token."""
-        if not self.refresh_token:
-            raise TadoAuthError("Nessun refresh_token disponibile.")
+    async def _refresh_access_token(self, stale_token=None):
+        """Rinnova l'access token tramite il broker condiviso dell'account."""
+        return await self._auth.async_refresh(self.tracer, stale_token)
 
-        url = f"{self._oauth_url}/token"
-        payload = {
-            "client_id": TADO_CLIENT_ID,
-            "grant_type": "refresh_token",
-            "refresh_token": self.refresh_token
-        }
-        
-        async with self._session.post(url, data=payload) as response:
-            if response.status in [400, 401]:
-                raise TadoAuthError("Refresh token rifiutato dal server.")
-            elif response.status != 200:
-                raise TadoApiError(f"Errore HTTP {response.status} durante il refresh.")
-            
-            data = await response.json()
-            self.access_token = data.get("access_token")
-            new_refresh = data.get("refresh_token")
-            
-            if new_refresh and new_refresh != self.refresh_token:
-                self.refresh_token = new_refresh
-                # Aggiorna il config_entry se esiste
-                if self.config_entry and hasattr(self.config_entry, "entry_id"):
-                    new_data = {**self.config_entry.data, "refresh_token": self.refresh_token}
-                    self.hass.config_entries.async_update_entry(self.config_entry, data=new_data)
-
-    async def _request(self, method: str, endpoint: str, json_data=None, retries=2):
+    async def _request(self, method: str, endpoint: str, json_data=None, retries=2, priority=PRIORITY_POLL):
         """Gestisce le chiamate API con rinnovo token e Auto-Retry in caso di Rate Limit (429)."""
         async with self._lock:
-            if not self.access_token:
-                await self._refresh_access_token()
+            self.admission.async_admit(priority, self.quota_remaining)
+            access_token = await self._auth.async_get_access_token(self.tracer)
 
             url = f"{self._api_url}{endpoint}"
-            headers = {"Authorization": f"Bearer {self.access_token}"}
+            headers = {"Authorization": f"Bearer {access_token}"}
 
             # Ciclo di tentativi (di default prova 3 volte: tentativo iniziale + 2 retries)
             for attempt in range(retries + 1):
-                async with self._session.request(method, url, headers=headers, json=json_data) as response:
+                with self.tracer.span("request", method=method, endpoint=endpoint, attempt=attempt) as span:
+                    async with self._session.request(method, url, headers=headers, json=json_data) as response:
+                        span.tags["status"] = response.status
+                        self.request_count += 1
+                        self._update_quota(response.headers)
                     
-                    # 1. Gestione Token Scaduto (401)
-                    if response.status == 401:
-                        if attempt < retries:
-                            _LOGGER.debug("Access token scaduto, tento il rinnovo (Tentativo %s)...", attempt + 1)
-                            await self._refresh_access_token()
-                            headers["Authorization"] = f"Bearer {self.access_token}"
-                            continue  # Riprova il ciclo con il nuovo token
-                        raise TadoAuthError("Non autorizzato anche dopo il refresh.")
-
-                    # 2. Gestione Rate Limit (429 - Troppe richieste)
-                    if response.status == 429:
-                        if attempt < retries:
-                            # Tado ci sta bloccando per la raffica. Aspettiamo 2.5 secondi e riproviamo.
-                            _LOGGER.warning("Rate limit (429) raggiunto. Pausa di 2.5s prima di riprovare...")
-                            await asyncio.sleep(2.5)
-                            continue  # Riprova il ciclo
-                        # Se fallisce anche dopo le pause, solleva l'errore senza crashare
-                        raise TadoApiError("Rate limit di Tado superato costantemente. Impossibile comunicare.")
-
-                    # 3. Altri errori generali
-                    response.raise_for_status()
+                        # 1. Gestione Token Scaduto (401)
+                        if response.status == 401:
+                            if attempt < retries:
+                                _LOGGER.debug("Access token scaduto, tento il rinnovo (Tentativo %s)...", attempt + 1)
+                                access_token = await self._refresh_access_token(access_token)
+                                headers["Authorization"] = f"Bearer {access_token}"
+                                continue  # Riprova il ciclo con il nuovo token
+                            raise TadoAuthError("Non autorizzato anche dopo il refresh.")
+
+                        # 2. Gestione Rate Limit (429 - Troppe richieste)
+                        if response.status == 429:
+                            if attempt < retries:
+                                # Tado ci sta bloccando per la raffica. Aspettiamo 2.5 secondi e riproviamo.
+                                _LOGGER.warning("Rate limit (429) raggiunto. Pausa di 2.5s prima di riprovare...")
+                                with self.tracer.span("rate_limit_sleep", endpoint=endpoint, attempt=attempt):
+                                    await asyncio.sleep(2.5)
+                                continue  # Riprova il ciclo
+                            # Se fallisce anche dopo le pause, solleva l'errore senza crashare
+                            raise TadoApiError("Rate limit di Tado superato costantemente. Impossibile comunicare.")
+
+                        # 3. Altri errori generali
+                        response.raise_for_status()
                     
-                    # 4. Successo
-                    return await response.json() if response.status != 204 else None
+                        # 4. Successo
+                        return await response.json() if response.status != 204 else None
+
+    def _update_quota(self, headers):
+        """Aggiorna la quota residua leggendo l'header RateLimit di Tado, se presente."""
+        ratelimit = headers.get("RateLimit")
+        remaining = _RATELIMIT_REMAINING.search(ratelimit) if ratelimit else None
+        if remaining:
+            self._quota_remaining = int(remaining.group(1))
+        elif self.quota_remaining:
+            # Nessun header in questa risposta: stimiamo la quota residua contando la chiamata
+            self._quota_remaining -= 1
+        reset = _RATELIMIT_RESET.search(ratelimit) if ratelimit else None
+        if reset:
+            self.quota_reset_at = time.monotonic() + int(reset.group(1))
+        self.admission.async_quota_updated(self.quota_remaining)
 
     async def _fetch_me(self):
         """Recupera l'Home ID dell'utente."""
         data = await self._request("GET", "/me")
         if data and "homes" in data and len(data["homes"]) > 0:
-            self.home_id = data["homes"][0]["id"]
+            self.home_id = self._auth.home_id = data["homes"][0]["id"]
         else:
             raise TadoApiError("Impossibile trovare una casa (Home ID) per questo account.")
 
     def get_refresh_token(self):
         return self.refresh_token
 
+    @callback
+    def async_hand_over_auth(self):
+        """Cede il broker di un config flow concluso alla entry che sta per essere creata con questo refresh token."""
+        pending = self.hass.data.setdefault(DOMAIN, {}).setdefault("pending_auth_brokers", {})
+        pending[self.refresh_token] = self._auth
+
     # --- METODI PER L'INTEGRAZIONE ---
 
     async def get_home_state(self):
@@ -199,20 +473,8 @@ class TadoAPI:
     async def get_mobile_devices(self):
         if not self.home_id: return 0
         devices = await self._request("GET", f"/homes/{self.home_id}/mobileDevices")
-        count = 0
-        for d in (devices or []):
-            # Controlla che il dispositivo sia effettivamente un dizionario valido
-            if not isinstance(d, dict):
-                continue
-            
-            # Usiamo "or {}" per prevenire i casi in cui l'API restituisce esplicitamente "null" (None in Python)
-            settings = d.get("settings") or {}
-            location = d.get("location") or {}
-            
-            if settings.get("geoTrackingEnabled") and location.get("atHome"):
-                count += 1
-                
-        return count
+        self.mobile_devices.update(devices)
+        return self.mobile_devices.count_at_home
 
     async def get_open_window_detected(self):
         if not self.home_id: return []
@@ -221,19 +483,33 @@ class TadoAPI:
         for zone in (zones or []):
             zone_id = zone["id"]
             state = await self._request("GET", f"/homes/{self.home_id}/zones/{zone_id}/state")
-            if state and state.get("openWindow"):
-                open_windows.append({"id": zone_id, "name": zone["name"]})
+            if not state:
+                continue
+            # openWindow: modalità finestra aperta già attiva; openWindowDetected: rilevata ma non ancora attivata
+            open_window = state.get("openWindow")
+            if open_window or state.get("openWindowDetected"):
+                open_windows.append({
+                    "id": zone_id,
+                    "name": zone["name"],
+                    "active": bool(open_window),
+                    "detected_time": open_window.get("detectedTime") if isinstance(open_window, dict) else None,
+                })
         return open_windows
 
-    async def set_home(self):
+    async def set_home(self, priority=PRIORITY_AUTOMATION):
         if not self.home_id: return
-        await self._request("PUT", f"/homes/{self.home_id}/presenceLock", {"homePresence": "HOME"})
+        await self._request("PUT", f"/homes/{self.home_id}/presenceLock", {"homePresence": "HOME"}, priority=priority)
+        self.history.record_action("set_home", priority=priority)
 
-    async def set_away(self):
+    async def set_away(self, priority=PRIORITY_AUTOMATION):
         if not self.home_id: return
-        await self._request("PUT", f"/homes/{self.home_id}/presenceLock", {"homePresence": "AWAY"})
+        await self._request("PUT", f"/homes/{self.home_id}/presenceLock", {"homePresence": "AWAY"}, priority=priority)
+        self.history.record_action("set_away", priority=priority)
 
-    async def set_open_window(self, zone_id):
+    async def set_open_window(self, zone_id, priority=PRIORITY_AUTOMATION):
         if not self.home_id: return
         # Tado API per attivare la mod. finestra aperta su una zona specifica
-        await self._request("POST", f"/homes/{self.home_id}/zones/{zone_id}/state/openWindow/activate")
\ No newline at end of file
+        await self._request(
+            "POST", f"/homes/{self.home_id}/zones/{zone_id}/state/openWindow/activate", priority=priority
+        )
+        self.history.record_action("set_open_window", zone_id=zone_id, priority=priority)
\ No newline at end of file
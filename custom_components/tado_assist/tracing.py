@@ -0,0 +1,203 @@
+"""Tracing leggero del ciclo di polling di Tado Assist."""
+
+import json
+import logging
+import time
+from contextvars import ContextVar
+from datetime import datetime
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+
+from .const import DOMAIN, EVENT_PROFILE_READY
+
+_LOGGER = logging.getLogger(__name__)
+
+# Span aperto nel task corrente: gli span aperti al suo interno vengono registrati come annidati
+_current_span = ContextVar("tado_assist_span", default=None)
+
+
+class _Span:
+    """Misura la durata di un blocco di codice e la registra nel tracer."""
+
+    def __init__(self, tracer, name, tags):
+        self._tracer = tracer
+        self.name = name
+        self.tags = tags
+        self._start = None
+        self._parent = None
+        self._children = 0.0
+        self._token = None
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self._parent = parent if parent is not None and parent._tracer is self._tracer else None
+        self._token = _current_span.set(self)
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.monotonic() - self._start
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.tags.setdefault("error", exc_type.__name__)
+        if self._parent is not None:
+            self._parent._children += duration
+        self._tracer._record(
+            self.name,
+            self._start,
+            duration,
+            duration - self._children,
+            self._parent.name if self._parent else None,
+            self.tags,
+        )
+        return False
+
+
+class TadoTracer:
+    """Emette gli span come log di debug strutturati e, su richiesta, cattura il profilo dei prossimi poll."""
+
+    def __init__(self, hass: HomeAssistant, name=None):
+        self.hass = hass
+        self.name = name
+        self._polls_remaining = 0
+        self._polls_requested = 0
+        self._captured_polls = []
+        self._current_poll = None
+        self._timeout_unsub = None
+
+    def span(self, name, **tags):
+        """Restituisce un context manager che traccia il blocco con i tag indicati."""
+        return _Span(self, name, tags)
+
+    def _record(self, name, start, duration, self_duration, parent, tags):
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug(
+                "span=%s parent=%s duration_ms=%.1f self_ms=%.1f %s",
+                name,
+                parent,
+                duration * 1000,
+                self_duration * 1000,
+                " ".join(f"{key}={value}" for key, value in tags.items()),
+            )
+
+        if self._current_poll is not None:
+            self._current_poll["spans"].append({
+                "name": name,
+                "parent": parent,
+                "offset_ms": round((start - self._current_poll["start"]) * 1000, 1),
+                "duration_ms": round(duration * 1000, 1),
+                # Tempo al netto degli span annidati (es. la pausa per il 429 dentro una request)
+                "self_ms": round(self_duration * 1000, 1),
+                **tags,
+            })
+
+    @property
+    def capturing(self):
+        return self._polls_remaining > 0
+
+    @callback
+    def async_start_capture(self, polls, timeout):
+        """Avvia la cattura del profilo per i prossimi N poll; allo scadere del timeout scrive un report parziale."""
+        _LOGGER.info("Cattura del profilo avviata per i prossimi %s poll.", polls)
+        self.async_cancel_capture()
+        self._polls_remaining = polls
+        self._polls_requested = polls
+        self._captured_polls = []
+        self._current_poll = None
+        self._timeout_unsub = async_call_later(self.hass, timeout, self._async_capture_timeout)
+
+    @callback
+    def async_cancel_capture(self):
+        """Interrompe la cattura in corso senza scrivere il report."""
+        if self._timeout_unsub:
+            self._timeout_unsub()
+            self._timeout_unsub = None
+        self._polls_remaining = 0
+        self._captured_polls = []
+        self._current_poll = None
+
+    @callback
+    def _async_capture_timeout(self, _now):
+        # Assistente spento o poll rimandati per la quota: il report contiene i poll catturati finora
+        self._timeout_unsub = None
+        _LOGGER.warning(
+            "Cattura del profilo scaduta dopo %s/%s poll, scrivo un report parziale.",
+            len(self._captured_polls), self._polls_requested,
+        )
+        polls, self._captured_polls = self._captured_polls, []
+        self._polls_remaining = 0
+        self._current_poll = None
+        self.hass.async_create_task(self._async_write_report(polls, partial=True))
+
+    def poll_started(self):
+        """Apre il record di un nuovo poll (chiude l'eventuale poll rimasto aperto)."""
+        if self._current_poll is not None:
+            self.poll_finished()
+        if self.capturing:
+            self._current_poll = {
+                "started_at": datetime.now().isoformat(),
+                "start": time.monotonic(),
+                "spans": [],
+            }
+
+    @callback
+    def poll_finished(self):
+        """Chiude il poll corrente; al raggiungimento di N poll scrive il report."""
+        poll = self._current_poll
+        if poll is None:
+            return
+        self._current_poll = None
+        poll["duration_ms"] = round((time.monotonic() - poll.pop("start")) * 1000, 1)
+        self._captured_polls.append(poll)
+        self._polls_remaining -= 1
+
+        if self._polls_remaining <= 0:
+            if self._timeout_unsub:
+                self._timeout_unsub()
+                self._timeout_unsub = None
+            polls, self._captured_polls = self._captured_polls, []
+            self.hass.async_create_task(self._async_write_report(polls))
+
+    async def _async_write_report(self, polls, partial=False):
+        report = {
+            "account": self.name,
+            "generated_at": datetime.now().isoformat(),
+            "partial": partial,
+            "polls_requested": self._polls_requested,
+            "polls": polls,
+            "summary": _summarize(polls),
+        }
+        suffix = f"_{self.name}" if self.name else ""
+        path = self.hass.config.path(f"{DOMAIN}_profile{suffix}_{datetime.now():%Y%m%d_%H%M%S}.json")
+        await self.hass.async_add_executor_job(_write_json, path, report)
+        _LOGGER.info("Profilo di %s poll salvato in %s", len(polls), path)
+        self.hass.bus.async_fire(
+            EVENT_PROFILE_READY, {"path": path, "polls": len(polls), "account": self.name, "partial": partial}
+        )
+
+
+def _summarize(polls):
+    """Aggrega gli span per nome: numero, tempo totale, medio e massimo.
+
+    self_ms esclude il tempo degli span annidati, quindi la somma dei self_ms non conta due volte
+    lo stesso intervallo (es. rate_limit_sleep dentro request).
+    """
+    summary = {}
+    for poll in polls:
+        for span in poll["spans"]:
+            item = summary.setdefault(span["name"], {"count": 0, "total_ms": 0.0, "self_ms": 0.0, "max_ms": 0.0})
+            item["count"] += 1
+            item["total_ms"] += span["duration_ms"]
+            item["self_ms"] += span["self_ms"]
+            item["max_ms"] = max(item["max_ms"], span["duration_ms"])
+    for item in summary.values():
+        item["total_ms"] = round(item["total_ms"], 1)
+        item["self_ms"] = round(item["self_ms"], 1)
+        item["avg_ms"] = round(item["total_ms"] / item["count"], 1)
+    return summary
+
+
+def _write_json(path, data):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(data, file, indent=2)
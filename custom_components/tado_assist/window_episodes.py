@@ -0,0 +1,102 @@
+"""Tracciamento per zona degli episodi di finestra aperta."""
+
+from homeassistant.util import dt as dt_util
+
+STATE_OPEN = "open"
+STATE_SUSPENDED = "suspended"
+STATE_CLOSED = "closed"
+STATE_RESUMED = "resumed"
+
+
+class WindowEpisode:
+    """Un episodio: dalla prima rilevazione della finestra aperta fino alla chiusura."""
+
+    def __init__(self, zone_id, zone_name, opened_at):
+        self.zone_id = zone_id
+        self.zone_name = zone_name
+        self.opened_at = opened_at
+        self.suspended_at = None
+        self.closed_at = None
+
+    @property
+    def state(self):
+        if self.closed_at:
+            # Se il riscaldamento era stato sospeso, alla chiusura riprende
+            return STATE_RESUMED if self.suspended_at else STATE_CLOSED
+        return STATE_SUSPENDED if self.suspended_at else STATE_OPEN
+
+    def duration(self, now):
+        return ((self.closed_at or now) - self.opened_at).total_seconds()
+
+
+class WindowEpisodeTracker:
+    """Ricostruisce gli episodi di ogni zona a partire dallo stato delle zone letto ad ogni poll."""
+
+    def __init__(self):
+        self._active = {}
+        self._last_closed = {}
+        self._counts = {}
+
+    def update(self, open_zones, now=None):
+        """Aggiorna gli episodi con le zone che Tado riporta con finestra aperta in questo poll."""
+        now = now or dt_util.utcnow()
+        seen = set()
+
+        for zone in open_zones:
+            zone_id = str(zone["id"])
+            seen.add(zone_id)
+            episode = self._active.get(zone_id)
+            if episode is None:
+                opened_at = dt_util.parse_datetime(zone.get("detected_time") or "") or now
+                episode = self._active[zone_id] = WindowEpisode(zone_id, zone["name"], min(opened_at, now))
+                self._counts[zone_id] = self._counts.get(zone_id, 0) + 1
+
+            # Tado ha già la modalità finestra aperta attiva (da noi o da un'altra app)
+            if zone.get("active") and not episode.suspended_at:
+                episode.suspended_at = now
+
+        for zone_id in set(self._active) - seen:
+            episode = self._active.pop(zone_id)
+            episode.closed_at = now
+            self._last_closed[zone_id] = episode
+
+    def zones_to_suspend(self, min_open_duration, now=None):
+        """Zone aperte da almeno min_open_duration secondi e non ancora sospese in questo episodio."""
+        now = now or dt_util.utcnow()
+        return [
+            episode.zone_id
+            for episode in self._active.values()
+            if not episode.suspended_at and episode.duration(now) >= min_open_duration
+        ]
+
+    def seconds_until_due(self, min_open_duration, now=None):
+        """Secondi prima che la prossima zona aperta e non sospesa raggiunga min_open_duration (None se nessuna)."""
+        now = now or dt_util.utcnow()
+        pending = [
+            min_open_duration - episode.duration(now)
+            for episode in self._active.values()
+            if not episode.suspended_at
+        ]
+        return max(min(pending), 0) if pending else None
+
+    def mark_suspended(self, zone_id, now=None):
+        episode = self._active.get(str(zone_id))
+        if episode and not episode.suspended_at:
+            episode.suspended_at = now or dt_util.utcnow()
+
+    def as_dict(self, now=None):
+        """Episodio corrente (o l'ultimo chiuso) di ogni zona, indicizzato per id (i nomi delle zone possono ripetersi)."""
+        now = now or dt_util.utcnow()
+        episodes = {**self._last_closed, **self._active}
+        return {
+            zone_id: {
+                "zone_id": zone_id,
+                "zone_name": episode.zone_name,
+                "state": episode.state,
+                "opened_at": episode.opened_at.isoformat(),
+                "closed_at": episode.closed_at.isoformat() if episode.closed_at else None,
+                "duration": round(episode.duration(now)),
+                "episodes": self._counts.get(zone_id, 0),
+            }
+            for zone_id, episode in episodes.items()
+        }
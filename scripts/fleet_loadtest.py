@@ -0,0 +1,301 @@
+"""Load test di Tado Assist: molte case simulate contro un finto server Tado locale.
+
+Avvia un'istanza minimale di Home Assistant, carica la vera integrazione (coordinator,
+scheduler condiviso e switch) con una config entry per ogni casa e la fa comunicare
+con un server aiohttp locale che imita le API Tado. Non richiede rete.
+
+Richiede Python 3.13 e la versione di Home Assistant indicata in scripts/requirements-loadtest.txt.
+
+Esempio:
+    python scripts/fleet_loadtest.py --homes 200 --zones 6 --scan-interval 10 --duration 60
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from types import MappingProxyType
+
+from aiohttp import web
+
+from homeassistant import bootstrap, config_entries, core, loader
+from homeassistant.components.network.network import async_get_network
+from homeassistant.helpers import entity_registry as er
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DOMAIN = "tado_assist"
+
+_LOGGER = logging.getLogger("fleet_loadtest")
+
+
+class FakeTadoServer:
+    """Server locale che risponde agli endpoint Tado usati dall'integrazione."""
+
+    def __init__(self, zones, latency, rate_limit_every):
+        self.zones = zones
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.requests = 0
+        self.writes = 0
+        self.open_window_active = set()
+        self._runner = None
+        self.url = None
+
+        app = web.Application()
+        app.router.add_post("/oauth2/token", self._token)
+        app.router.add_get("/api/v2/me", self._me)
+        app.router.add_get("/api/v2/homes/{home_id}/state", self._home_state)
+        app.router.add_get("/api/v2/homes/{home_id}/mobileDevices", self._mobile_devices)
+        app.router.add_get("/api/v2/homes/{home_id}/zones", self._zones)
+        app.router.add_get("/api/v2/homes/{home_id}/zones/{zone_id}/state", self._zone_state)
+        app.router.add_put("/api/v2/homes/{home_id}/presenceLock", self._write)
+        app.router.add_post("/api/v2/homes/{home_id}/zones/{zone_id}/state/openWindow/activate", self._activate_open_window)
+        self._app = app
+
+    async def async_start(self):
+        self._runner = web.AppRunner(self._app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def async_stop(self):
+        await self._runner.cleanup()
+
+    async def _respond(self, payload=None, status=200):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.rate_limit_every and self.requests % self.rate_limit_every == 0:
+            return web.json_response({"errors": []}, status=429)
+        if payload is None:
+            return web.Response(status=204)
+        return web.json_response(payload, status=status)
+
+    async def _token(self, request):
+        form = await request.post()
+        # Il refresh token "home-<n>" identifica la casa: lo riusiamo come access token
+        token = form.get("refresh_token", "home-0")
+        return await self._respond({"access_token": token, "refresh_token": token, "expires_in": 600})
+
+    async def _me(self, request):
+        home_id = int(request.headers["Authorization"].rsplit("-", 1)[1])
+        return await self._respond({"homes": [{"id": home_id, "name": f"Casa {home_id}"}]})
+
+    async def _home_state(self, request):
+        home_id = int(request.match_info["home_id"])
+        return await self._respond({"presence": "HOME" if home_id % 2 else "AWAY"})
+
+    async def _mobile_devices(self, request):
+        home_id = int(request.match_info["home_id"])
+        return await self._respond([
+            {"id": device, "name": f"Telefono {device}", "settings": {"geoTrackingEnabled": True}, "location": {"atHome": (home_id + device) % 3 == 0}}
+            for device in range(2)
+        ])
+
+    async def _zones(self, request):
+        return await self._respond([{"id": zone, "name": f"Zona {zone}"} for zone in range(1, self.zones + 1)])
+
+    async def _zone_state(self, request):
+        # La zona 1 di ogni casa ha sempre la finestra aperta: rilevata finché non viene attivata la sospensione
+        zone_id = int(request.match_info["zone_id"])
+        activated = (request.match_info["home_id"], zone_id) in self.open_window_active
+        return await self._respond({
+            "openWindowDetected": zone_id == 1 and not activated,
+            "openWindow": {"detectedTime": "2024-01-01T00:00:00Z"} if activated else None,
+        })
+
+    async def _write(self, request):
+        self.writes += 1
+        return await self._respond()
+
+    async def _activate_open_window(self, request):
+        self.open_window_active.add((request.match_info["home_id"], int(request.match_info["zone_id"])))
+        return await self._write(request)
+
+
+class LoopLagMonitor:
+    """Misura il ritardo dell'event loop rispetto a uno sleep periodico."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        self._task.cancel()
+
+    async def _run(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.samples.append(time.monotonic() - start - self.interval)
+
+
+def _percentiles(values):
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "count": len(ordered),
+        "p50_ms": round(pick(0.50) * 1000, 1),
+        "p90_ms": round(pick(0.90) * 1000, 1),
+        "p99_ms": round(pick(0.99) * 1000, 1),
+        "max_ms": round(ordered[-1] * 1000, 1),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 1),
+    }
+
+
+async def _async_start_hass(config_dir):
+    """Avvia un'istanza minimale di Home Assistant con l'integrazione tra i custom_components."""
+    (Path(config_dir) / "custom_components").symlink_to(REPO_ROOT / "custom_components")
+    hass = core.HomeAssistant(config_dir)
+    hass.config.skip_pip = True
+    loader.async_setup(hass)
+    hass.config_entries = config_entries.ConfigEntries(hass, {})
+    await bootstrap.async_load_base_functionality(hass)
+    # Gli adattatori di rete servono al resolver della sessione aiohttp condivisa di HA
+    await async_get_network(hass)
+    await hass.async_start()
+    return hass
+
+
+def _make_entry(server, home, scan_interval):
+    return config_entries.ConfigEntry(
+        data={
+            "scan_interval": scan_interval,
+            "api_url": f"{server.url}/api/v2",
+            "oauth_url": f"{server.url}/oauth2",
+            "refresh_token": f"home-{home}",
+            # Sospende subito: ogni casa genera una sola scrittura per l'episodio di finestra aperta
+            "min_open_duration": 0,
+        },
+        discovery_keys=MappingProxyType({}),
+        domain=DOMAIN,
+        minor_version=1,
+        options={},
+        source=config_entries.SOURCE_USER,
+        subentries_data=None,
+        title=f"Casa {home}",
+        unique_id=f"home-{home}",
+        version=1,
+    )
+
+
+async def async_run(args):
+    server = FakeTadoServer(args.zones, args.latency, args.rate_limit_every)
+    await server.async_start()
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = await _async_start_hass(config_dir)
+        monitor = LoopLagMonitor()
+        monitor.start()
+
+        # La memoria viene tracciata per tutta la durata: a fine misura include anche dati del
+        # coordinator, storico dei poll, episodi delle finestre e dispositivi di ogni casa
+        if args.trace_memory:
+            tracemalloc.start()
+            memory_before = tracemalloc.get_traced_memory()[0]
+        setup_start = time.monotonic()
+        for home in range(1, args.homes + 1):
+            await hass.config_entries.async_add(_make_entry(server, home, args.scan_interval))
+        setup_time = time.monotonic() - setup_start
+        if args.trace_memory:
+            setup_memory = tracemalloc.get_traced_memory()[0] - memory_before
+
+        # Misura la durata di ogni poll avvolgendo l'update_method reale del coordinator
+        poll_durations = []
+        loaded_entries = hass.config_entries.async_loaded_entries(DOMAIN)
+        for entry in loaded_entries:
+            coordinator = hass.data[DOMAIN][entry.entry_id]["coordinator"]
+            update_method = coordinator.update_method
+
+            async def _timed(update_method=update_method):
+                start = time.monotonic()
+                try:
+                    return await update_method()
+                finally:
+                    poll_durations.append(time.monotonic() - start)
+
+            coordinator.update_method = _timed
+
+        # Attiva l'assistente, la georeferenziazione e il controllo finestre di ogni casa
+        registry = er.async_get(hass)
+        switches = [
+            entity.entity_id
+            for entity in registry.entities.values()
+            if entity.platform == DOMAIN
+            and entity.unique_id.endswith(("_tado_enabled_assist", "_georeferencing_switch", "_window_control_switch"))
+        ]
+        await hass.services.async_call("switch", "turn_on", {"entity_id": switches}, blocking=True)
+
+        requests_before = server.requests
+        monitor.samples.clear()
+        await asyncio.sleep(args.duration)
+        requests = server.requests - requests_before
+
+        if args.trace_memory:
+            memory = tracemalloc.get_traced_memory()[0] - memory_before
+            tracemalloc.stop()
+        history_entries = [len(hass.data[DOMAIN][entry.entry_id]["tado"].history) for entry in loaded_entries]
+
+        monitor.stop()
+        await hass.async_stop(force=True)
+
+    await server.async_stop()
+
+    report = {
+        "homes": args.homes,
+        "homes_loaded": len(loaded_entries),
+        "zones_per_home": args.zones,
+        "scan_interval_s": args.scan_interval,
+        "duration_s": args.duration,
+        "setup_time_s": round(setup_time, 2),
+        "setup_memory_per_home_kib": round(setup_memory / args.homes / 1024, 1) if args.trace_memory else None,
+        "memory_per_home_kib": round(memory / args.homes / 1024, 1) if args.trace_memory else None,
+        "history_entries_per_home": round(statistics.fmean(history_entries), 1) if history_entries else 0,
+        "requests_per_second": round(requests / args.duration, 1),
+        "writes": server.writes,
+        "poll_completion": _percentiles(poll_durations),
+        "loop_lag": _percentiles(monitor.samples),
+    }
+    print(json.dumps(report, indent=2))
+
+    if report["homes_loaded"] < args.homes or not poll_durations:
+        print(f"FAIL: {report['homes_loaded']}/{args.homes} homes loaded, {len(poll_durations)} polls", file=sys.stderr)
+        return 1
+    if args.max_loop_lag_ms and report["loop_lag"].get("p99_ms", 0) > args.max_loop_lag_ms:
+        print(f"FAIL: p99 loop lag above {args.max_loop_lag_ms} ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--homes", type=int, default=100, help="numero di case simulate")
+    parser.add_argument("--zones", type=int, default=5, help="zone per casa")
+    parser.add_argument("--scan-interval", type=int, default=10, help="intervallo di aggiornamento (s)")
+    parser.add_argument("--duration", type=float, default=30, help="durata della misura (s)")
+    parser.add_argument("--latency", type=float, default=0.02, help="latenza simulata per richiesta (s)")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="restituisce 429 ogni N richieste (0 = mai)")
+    parser.add_argument("--no-trace-memory", dest="trace_memory", action="store_false", help="non misura la memoria (tracemalloc rallenta i poll e aumenta il lag)")
+    parser.add_argument("--max-loop-lag-ms", type=float, default=0, help="esce con errore se il p99 del lag supera la soglia")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(asyncio.run(async_run(args)))
+
+
+if __name__ == "__main__":
+    main()